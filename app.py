@@ -1,11 +1,15 @@
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 import plotly.express as px
 import plotly.graph_objects as go
 from statsmodels.tsa.seasonal import MSTL
 from statsmodels.tsa.api import ExponentialSmoothing
+from scipy.spatial import cKDTree
+import numpy as np
 import pandas as pd
 
 from geocode import Geocoder
@@ -32,80 +36,176 @@ st.markdown(hide_decoration_bar_style, unsafe_allow_html=True)
 
 location_manager = LocationManager()
 
-def add_forecasts(df: pd.DataFrame, columns_to_forecast: list, facet_col: str, prediction_horizon: int = 24, periods: int = 52):
+@st.cache_data(ttl=3600)
+def load_abwasser() -> pd.DataFrame:
     """
-    For each column in columns_to_forecast, this function fits an Exponential Smoothing model,
-    generates a forecast for prediction_horizon time steps, and adds the fitted values and forecast
-    as a new column named '{original_column}_forecast' to the dataframe.
+    Loads the AMELAG wastewater data of the individual treatment plants.
+    The result is cached for an hour, matching the update interval of the data submodules.
     """
-    forecast_dfs = []
+    abwasser = pd.read_csv('data/Abwassersurveillance_AMELAG/amelag_einzelstandorte.tsv', sep='\t', engine='pyarrow',
+                           dtype={'loess_vorhersage': 'float32', 'bundesland': 'category', 'standort': 'category', 'typ': 'category'})
+    abwasser['datum'] = pd.to_datetime(abwasser['datum'])
+    abwasser.set_index('datum', inplace=True)
+    return abwasser
+
+
+@st.cache_data(ttl=3600)
+def load_abwasser_standorte() -> dict[str, list[str]]:
+    """
+    Returns the sorted Klärwerk locations (standorte) per Bundesland of the AMELAG data.
+    Cached like load_abwasser, so reruns do not scan the data again for the select boxes.
+    """
+    abwasser = load_abwasser()
+    pairs = abwasser[['bundesland', 'standort']].dropna().drop_duplicates()
+    return {bundesland: sorted(standorte) for bundesland, standorte in pairs.groupby('bundesland', observed=True)['standort']}
+
+
+@st.cache_data(ttl=3600)
+def load_grippeweb() -> pd.DataFrame:
+    """
+    Loads the GrippeWeb data and derives the date index, the percentage of infected population
+    and the translated illness names.
+    The result is cached for an hour, matching the update interval of the data submodules.
+    """
+    grippeweb = pd.read_csv('data/GrippeWeb_Daten_des_Wochenberichts/GrippeWeb_Daten_des_Wochenberichts.tsv', sep='\t', engine='pyarrow',
+                            dtype={'Inzidenz': 'float32', 'Kalenderwoche': 'category', 'Region': 'category', 'Erkrankung': 'category', 'Altersgruppe': 'category'})
+    # ISO week e.g. 2024-W05, Friday is used as the date of the week,
+    # each week is parsed once and mapped to the rows of all regions, illnesses and age groups
+    kalenderwochen = grippeweb['Kalenderwoche'].cat
+    grippeweb['Datum'] = pd.to_datetime(kalenderwochen.categories + '-5', format='%G-W%V-%u')[kalenderwochen.codes]
+    grippeweb.set_index('Datum', inplace=True)
+    # incidence per 100000 inhabitants in percent, computed once here instead of per slice on every rerun
+    grippeweb[percentage_infected_term] = grippeweb['Inzidenz'].to_numpy() * np.float32(100 / 100000)
+    grippeweb['Erkrankung'] = grippeweb['Erkrankung'].cat.rename_categories({'ILI': ili_term, 'ARE': are_term})
+    return grippeweb
+
 
-    for col in columns_to_forecast:
-        # Filter the dataframe for the current illness
-        for illness in df[facet_col].unique():
-            df_illness = df[df[facet_col] == illness]
-            # set frequency to weekly Friday
-            df_illness = df_illness.asfreq('W-FRI')
+def _holt_winters(series_values: np.ndarray, periods: int) -> ExponentialSmoothing:
+    """
+    Creates the additive Holt-Winters model used for all forecasts.
+    """
+    return ExponentialSmoothing(
+        series_values,
+        seasonal_periods=periods,
+        trend="add",
+        seasonal="add",
+        use_boxcox=False,
+        initialization_method="estimated"
+    )
 
-            # Fit the Exponential Smoothing model for the current column
-            model = ExponentialSmoothing(
-                df_illness[col],
-                seasonal_periods=periods,
-                trend="add",
-                seasonal="add",
-                use_boxcox=False,
-                initialization_method="estimated"
-            ).fit()
 
-            # Generate forecast for the defined prediction horizon
-            forecast = model.forecast(prediction_horizon)
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _fit_smoothing_params(series_values: np.ndarray, periods: int) -> dict:
+    """
+    Fits a Holt-Winters model to the given series values and returns its smoothing parameters,
+    to be reused for related series by _fit_and_forecast.
+    """
+    params = _holt_winters(series_values, periods).fit(use_brute=False).params
+    return {name: params[name] for name in ('smoothing_level', 'smoothing_trend', 'smoothing_seasonal')}
 
-            # Create a new DataFrame from the forecasted series and set facet_col to illness
-            forecast_df = pd.DataFrame(forecast, columns=[col + '_forecast'])
-            forecast_df[facet_col] = illness
-            forecast_dfs.append(forecast_df)
 
-    # Concatenate all forecast dataframes with the original dataframe
-    df = pd.concat([df] + forecast_dfs, join='outer')
-    return df
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fit_and_forecast(series_values: np.ndarray, periods: int, prediction_horizon: int, smoothing_params: dict | None = None) -> np.ndarray:
+    """
+    Fits an Exponential Smoothing model to the given series values and returns the forecast for
+    prediction_horizon time steps. Cached on the series values and parameters so that reruns
+    triggered by widget interactions reuse the fitted model instead of solving it again, e.g.
+    selecting an additional age group only fits the model for the new group.
+    If smoothing_params from _fit_smoothing_params are given, they are kept fixed and only the
+    initial states are estimated, which is considerably cheaper than optimizing all parameters.
+    """
+    model = _holt_winters(series_values, periods)
+    # skip the brute force grid search for starting values of the smoothing parameters,
+    # L-BFGS-B converges faster without it and to an equal or lower SSE on the GrippeWeb series
+    if smoothing_params:
+        with model.fix_params(smoothing_params):
+            fitted_model = model.fit(use_brute=False)
+    else:
+        fitted_model = model.fit(use_brute=False)
+    return fitted_model.forecast(prediction_horizon)
 
 
-def plot_forecast(figure, dataframe, facet):
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def make_forecasts(df: pd.DataFrame, columns_to_forecast: list, facet_col: str, prediction_horizon: int = 24, periods: int = 52, freq: str = 'W-FRI',
+                   reference: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    For each column in columns_to_forecast and each value of facet_col, this function fits an Exponential Smoothing model
+    and generates a forecast for prediction_horizon time steps.
+    The models of the individual facet groups are independent and fitted in parallel.
+    If a reference DataFrame with the same columns is given, e.g. the total of all facet groups, the smoothing parameters
+    are fitted once per column on the reference and shared by all facet groups instead of being optimized per group.
+    Returns the forecasts as a separate DataFrame with the column facet_col and a column named
+    '{original_column}_forecast' per forecasted column, indexed by the forecast dates.
+    """
+    forecast_cols = [col + '_forecast' for col in columns_to_forecast]
+    # set frequency to weekly Friday, once per group for all columns
+    groups = [(illness, df_illness.asfreq(freq)) for illness, df_illness in df.groupby(facet_col, sort=False, observed=True)]
+    if not groups:
+        return pd.DataFrame(columns=forecast_cols + [facet_col])
+
+    # Forecasts of group i are written to the rows i * prediction_horizon to (i + 1) * prediction_horizon
+    forecast_values = np.empty((len(groups) * prediction_horizon, len(columns_to_forecast)))
+    # The workers call the st.cache_data functions _fit_smoothing_params and _fit_and_forecast, which need the
+    # ScriptRunContext of the script thread. Without it streamlit logs a missing ScriptRunContext warning per worker.
+    with ThreadPoolExecutor(initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+        if reference is not None and not reference.empty:
+            reference = reference.asfreq(freq)
+            smoothing_params = [executor.submit(_fit_smoothing_params, reference[col].to_numpy(), periods) for col in columns_to_forecast]
+            smoothing_params = [future.result() for future in smoothing_params]
+        else:
+            smoothing_params = [None] * len(columns_to_forecast)
+        futures = [
+            [executor.submit(_fit_and_forecast, df_illness[col].to_numpy(), periods, prediction_horizon, params)
+             for col, params in zip(columns_to_forecast, smoothing_params)]
+            for _, df_illness in groups
+        ]
+        for i, group_futures in enumerate(futures):
+            for j, future in enumerate(group_futures):
+                forecast_values[i * prediction_horizon:(i + 1) * prediction_horizon, j] = future.result()
+
+    forecast_index = [pd.date_range(df_illness.index[-1], periods=prediction_horizon + 1, freq=freq)[1:] for _, df_illness in groups]
+    forecast_df = pd.DataFrame(forecast_values, index=forecast_index[0].append(forecast_index[1:]), columns=forecast_cols)
+    forecast_df[facet_col] = np.repeat(np.array([illness for illness, _ in groups], dtype=object), prediction_horizon)
+    return forecast_df
+
+
+def plot_forecast(figure, dataframe, facet, groups=None):
     """
     Adds forecast traces to the provided Plotly figure.
-    It looks for _forecast columns in the dataframe, groups the data by the given facet and adds the traces to the plot.
+    It looks for _forecast columns in the forecast dataframe returned by make_forecasts,
+    groups the data by the given facet and adds the traces to the plot.
+    The facet values can be passed as groups if the caller already knows them, otherwise they are taken from the dataframe.
     Ensures forecast lines use the same color as their corresponding historical data.
     """
     forecast_cols = [col for col in dataframe.columns if col.endswith('_forecast')]
-    if not forecast_cols:
+    if not forecast_cols or dataframe.empty:
         return figure
     forecast_col = forecast_cols[0]
+    if groups is None:
+        groups = sorted(dataframe[facet].unique())
 
     # Get the colors from the existing traces
-    color_map = {}
-    for trace in figure.data:
-        if trace.name in dataframe[facet].unique():
-            color_map[trace.name] = trace.line.color
-
-    for group in sorted(dataframe[facet].unique()):
-        df_temp = dataframe[dataframe[facet] == group]
-        # Use the same color as the original trace
-        color = color_map.get(group)
-        figure.add_trace(
-            go.Scatter(
-                x=df_temp.index,
-                y=df_temp[forecast_col],
-                mode='lines',
-                line=dict(color=color, dash='dash'),
-                name=f'{group} forecast'
-            )
+    color_map = {trace.name: trace.line.color for trace in figure.data if trace.name in groups}
+
+    forecasts = dict(list(dataframe[forecast_col].groupby(dataframe[facet], observed=True)))
+    # Add all forecast traces in one call, using the same color as the original trace
+    figure.add_traces([
+        go.Scatter(
+            x=forecasts[group].index,
+            y=forecasts[group],
+            mode='lines',
+            line=dict(color=color_map.get(group), dash='dash'),
+            name=f'{group} forecast'
         )
+        for group in groups if group in forecasts
+    ])
     # Add a vertical line for today
-    today = pd.to_datetime('today')
+    today = np.datetime64('today')
+    yrange = figure.layout.yaxis.range or (None, 15)
     figure.add_vline(x=today, line_width=1, line_dash="dash", line_color="red")
     figure.add_annotation(
         x=today,
-        y=figure.layout.yaxis.range[1] if figure.layout.yaxis.range else 15,
+        y=yrange[1],
         text="Today",
         showarrow=False,
         xanchor="right",
@@ -114,32 +214,75 @@ def plot_forecast(figure, dataframe, facet):
     return figure
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _decompose(series: pd.Series):
+    """
+    Decomposes the series with MSTL.
+    Cached on the series so that the decomposition is only computed once per data update.
+    """
+    return MSTL(series).fit()
+
+
 def decompose_and_plot(df: pd.DataFrame, illness: str, infected_column: str):
     """
     Decomposes the time series for the specified illness and plots the result.
     """
     series = df[df['Erkrankung'] == illness][infected_column]
-    decomposed = MSTL(series).fit()
+    decomposed = _decompose(series)
     fig = decomposed.plot()
     fig.suptitle(f'Decomposition {illness}')
     return fig
 
 
-def find_closest_klaerwerk(df, user_location) -> str:
+@st.cache_resource
+def get_geocoder() -> Geocoder:
+    """
+    Returns a Geocoder shared by all sessions, so the geonames data is loaded at most once per process.
+    """
+    return Geocoder()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def standort_coords_table(standorte: tuple) -> pd.DataFrame:
+    """
+    Geocodes each wastewater treatment plant (Klärwerk) location once and returns a table
+    with the columns 'standort', 'lat' and 'lon'.
+    """
+    coordinates = get_geocoder().geocode_many(standorte, country='DE')
+    table = pd.DataFrame(coordinates, columns=['lat', 'lon'], dtype='float32')
+    table.insert(0, 'standort', standorte)
+    return table
+
+
+def _unit_vectors(lat, lon) -> np.ndarray:
     """
-    Finds the closest wastewater treatment plant (Klärwerk) to the given coordinates.
+    Converts latitudes and longitudes in degrees to 3D unit vectors, whose euclidean (chord) distance
+    increases monotonically with the great-circle distance.
     """
-    local_geocoder = Geocoder()
-    # get distinct standorte
-    distinct_standorte = sorted(df['standort'].dropna().unique())
-    distinct_standorte = pd.DataFrame(distinct_standorte, columns=['standort'])
-    # add coordinates for each standort
-    distinct_standorte['coordinates'] = distinct_standorte.apply(lambda x: local_geocoder.geocode(city=x['standort'], country='DE'), axis=1)
-    distinct_standorte['latitude'] = distinct_standorte['coordinates'].apply(lambda x: x[0])
-    distinct_standorte['longitude'] = distinct_standorte['coordinates'].apply(lambda x: x[1])
-    distinct_standorte['distance'] = ((distinct_standorte['latitude'] - user_location['latitude']) ** 2 + (distinct_standorte['longitude'] - user_location['longitude']) ** 2) ** 0.5
-    closest_klaerwerk = distinct_standorte.loc[distinct_standorte['distance'].idxmin()]
-    return closest_klaerwerk['standort']
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+@st.cache_resource(ttl=3600)
+def klaerwerk_tree(standorte: tuple) -> tuple[cKDTree, np.ndarray]:
+    """
+    Builds a k-d tree over the geocoded wastewater treatment plant (Klärwerk) locations
+    and returns it with the names of the locations in the order of the tree's points.
+    Locations that could not be geocoded are left out.
+    """
+    table = standort_coords_table(standorte).dropna()
+    return cKDTree(_unit_vectors(table['lat'].to_numpy(), table['lon'].to_numpy())), table['standort'].to_numpy()
+
+
+def find_closest_klaerwerk(standorte, user_location) -> str:
+    """
+    Finds the closest of the given wastewater treatment plants (Klärwerk) to the given coordinates
+    by a nearest neighbour query of the k-d tree from klaerwerk_tree.
+    """
+    tree, names = klaerwerk_tree(tuple(standorte))
+    _, index = tree.query(_unit_vectors(user_location['latitude'], user_location['longitude'])[0])
+    return names[index]
 
 
 st.title('Virus Radar 🦠')
@@ -163,17 +306,18 @@ tab1, tab2,  = st.tabs(["Grippeweb", "Abwasser"])
 
 with tab2:
     # Load the abwasser data
-    abwasser = pd.read_csv('data/Abwassersurveillance_AMELAG/amelag_einzelstandorte.tsv', sep='\t')
-    distinct_province_short = sorted(abwasser['bundesland'].dropna().unique())
+    abwasser = load_abwasser()
+    standorte_by_bundesland = load_abwasser_standorte()
+    distinct_province_short = sorted(standorte_by_bundesland)
     if 'province_short' in location_manager.location:
         if location_manager.location['province_short'] in distinct_province_short:
             land_index = distinct_province_short.index(location_manager.location['province_short'])
 
     selected_bundesland = st.selectbox('Bundesland', distinct_province_short, index=land_index)
-    distinct_standorte = sorted(abwasser[abwasser['bundesland'] == selected_bundesland]['standort'].dropna().unique())
+    distinct_standorte = standorte_by_bundesland[selected_bundesland]
 
     if location_manager.location['latitude'] is not None and location_manager.location['longitude'] is not None:
-        closest_klaerwerk = find_closest_klaerwerk(abwasser, location_manager.location)
+        closest_klaerwerk = find_closest_klaerwerk(sorted(itertools.chain.from_iterable(standorte_by_bundesland.values())), location_manager.location)
         klaerwerk_index = distinct_standorte.index(closest_klaerwerk)
     else:
         # if no location is available, set the index to 0
@@ -184,10 +328,9 @@ with tab2:
 
     abwasser = abwasser[abwasser['standort'] == standort]
     abwasser = abwasser[abwasser['typ'] != "Influenza A+B"]
-    abwasser.set_index('datum', inplace=True)
 
     # forecast would need at least 2 yrs of data so not active for now
-    # abwasser = add_forecasts(abwasser, ['loess_vorhersage'], facet_col='typ', periods=365)
+    # abwasser_forecast = make_forecasts(abwasser, ['loess_vorhersage'], facet_col='typ', periods=365)
     last_updated = pd.to_datetime(abwasser.index.max()).date()
     # start date is last update - 2 years
     start_date = last_updated - pd.DateOffset(years=1)
@@ -195,7 +338,7 @@ with tab2:
     fig_abwasser = px.area(abwasser, y='loess_vorhersage', color='typ',
                            title=f'Geglättete Abwasserwerte {standort}',
                            labels={'datum': '', 'loess_vorhersage': 'Loess geglättete Werte', 'typ': 'Virus'})
-    # fig_abwasser = plot_forecast(fig_abwasser, abwasser, 'typ')
+    # fig_abwasser = plot_forecast(fig_abwasser, abwasser_forecast, 'typ')
     fig_abwasser.update_xaxes(type="date", range=[start_date, last_updated])
 
     st.plotly_chart(fig_abwasser, use_container_width=True)
@@ -204,9 +347,10 @@ with tab2:
 
 with tab1:
     # Load the grippeweb data
-    grippeweb = pd.read_csv('data/GrippeWeb_Daten_des_Wochenberichts/GrippeWeb_Daten_des_Wochenberichts.tsv', sep='\t')
+    grippeweb = load_grippeweb()
 
-    regions = sorted(grippeweb['Region'].unique())
+    # the categories are the distinct regions, no need to scan the data
+    regions = sorted(grippeweb['Region'].cat.categories)
 
     if 'region' in location_manager.location:
         # if region is in the list of regions, set it as default
@@ -216,44 +360,47 @@ with tab1:
         region_index = 4
     region = st.selectbox('Region', regions, key='region', index=region_index)
 
-    grippeweb[['Jahr', 'Woche']] = grippeweb['Kalenderwoche'].str.split('-W', expand=True)
-    grippeweb['Datum'] = pd.to_datetime(grippeweb['Jahr'] + grippeweb['Woche'].add('-5'), format='%G%V-%u')
-    grippeweb.set_index('Datum', inplace=True)
-
-    grippeweb[percentage_infected_term] = (grippeweb['Inzidenz'] / 100000) * 100
+    # Split the data by region once and reuse the groups below
+    grippeweb_by_region = dict(list(grippeweb.groupby('Region', sort=False, observed=True)))
 
     # By focus area
-    grippeweb_region = grippeweb[grippeweb['Region'] == region].copy()
-    grippeweb_region['Erkrankung'] = grippeweb_region['Erkrankung'].replace({'ILI': ili_term, 'ARE': are_term})
+    grippeweb_region = grippeweb_by_region[region]
     last_updated = pd.to_datetime(grippeweb_region.index.max())
     start_date = last_updated - pd.DateOffset(years=2)
 
-    grippeweb_region = add_forecasts(grippeweb_region, [percentage_infected_term], facet_col='Erkrankung')
-    end_date = pd.to_datetime(grippeweb_region.index.max())
-    are_ili_by_region = px.area(grippeweb_region, y=percentage_infected_term, color='Erkrankung', title=f'Region {region}', labels={'index': ''})
-    are_ili_by_region = plot_forecast(are_ili_by_region, grippeweb_region, 'Erkrankung')
+    grippeweb_region_forecast = make_forecasts(grippeweb_region, [percentage_infected_term], facet_col='Erkrankung')
+    end_date = pd.to_datetime(grippeweb_region_forecast.index.max())
+    are_ili_by_region = px.area(grippeweb_region, y=percentage_infected_term, color='Erkrankung', title=f'Region {region}', labels={'Datum': ''})
+    are_ili_by_region = plot_forecast(are_ili_by_region, grippeweb_region_forecast, 'Erkrankung', sorted(grippeweb['Erkrankung'].cat.categories))
     are_ili_by_region.update_xaxes(type="date", range=[start_date, end_date])
 
 
     # Age groups only exist for bundesweite data
-    bundesweit = grippeweb[grippeweb['Region'] == "Bundesweit"]
+    bundesweit = grippeweb_by_region["Bundesweit"]
+    # all ages, the age group forecasts share the smoothing parameters fitted on it
+    bundesweit_total_by_erkrankung = dict(list(bundesweit[bundesweit['Altersgruppe'] == '00+'].groupby('Erkrankung', sort=False, observed=True)))
 
     altersgruppen = st.multiselect('Altersgruppen', ['0-4', '5-14', '15-34', '35-59', '60+'], default=['0-4', '5-14'])
     bundesweit = bundesweit[bundesweit['Altersgruppe'].isin(altersgruppen)]
+    bundesweit_by_erkrankung = dict(list(bundesweit.groupby('Erkrankung', sort=False, observed=True)))
+    # no group for an illness without rows, e.g. if no age group is selected
+    bundesweit_empty = bundesweit.iloc[:0]
 
     # Akute respiratorische Erkrankungen (ARE)
-    bundesweit_are = bundesweit[bundesweit['Erkrankung'] == "ARE"]
-    bundesweit_are = add_forecasts(bundesweit_are, [percentage_infected_term], facet_col='Altersgruppe')
-    are_by_age_groups = px.line(bundesweit_are, y=percentage_infected_term, color='Altersgruppe', title=f'{are_term} nach Altersgruppen', labels={'index': ''})
-    are_by_age_groups = plot_forecast(are_by_age_groups, bundesweit_are, 'Altersgruppe')
+    bundesweit_are = bundesweit_by_erkrankung.get(are_term, bundesweit_empty)
+    bundesweit_are_forecast = make_forecasts(bundesweit_are, [percentage_infected_term], facet_col='Altersgruppe',
+                                             reference=bundesweit_total_by_erkrankung.get(are_term))
+    are_by_age_groups = px.line(bundesweit_are, y=percentage_infected_term, color='Altersgruppe', title=f'{are_term} nach Altersgruppen', labels={'Datum': ''})
+    are_by_age_groups = plot_forecast(are_by_age_groups, bundesweit_are_forecast, 'Altersgruppe', sorted(altersgruppen))
     are_by_age_groups.update_xaxes(type="date", range=[start_date, end_date])
 
 
     # Grippeähnliche Erkrankungen (ILI)
-    bundesweit_ili = bundesweit[bundesweit['Erkrankung'] == "ILI"]
-    bundesweit_ili = add_forecasts(bundesweit_ili, [percentage_infected_term], facet_col='Altersgruppe')
-    ili_by_age_groups = px.line(bundesweit_ili, y=percentage_infected_term, color='Altersgruppe', title=f'{ili_term} nach Altersgruppen', labels={'index': ''})
-    ili_by_age_groups = plot_forecast(ili_by_age_groups, bundesweit_ili, 'Altersgruppe')
+    bundesweit_ili = bundesweit_by_erkrankung.get(ili_term, bundesweit_empty)
+    bundesweit_ili_forecast = make_forecasts(bundesweit_ili, [percentage_infected_term], facet_col='Altersgruppe',
+                                             reference=bundesweit_total_by_erkrankung.get(ili_term))
+    ili_by_age_groups = px.line(bundesweit_ili, y=percentage_infected_term, color='Altersgruppe', title=f'{ili_term} nach Altersgruppen', labels={'Datum': ''})
+    ili_by_age_groups = plot_forecast(ili_by_age_groups, bundesweit_ili_forecast, 'Altersgruppe', sorted(altersgruppen))
     ili_by_age_groups.update_xaxes(type="date", range=[start_date, end_date])
 
 
@@ -0,0 +1,13 @@
+import pytest
+
+from geocode import Geocoder
+
+@pytest.fixture(scope="session")
+def geocoder(tmp_path_factory):
+    """
+    An instance of the Geocoder class shared by all tests.
+    Its persistent cache and parquet snapshot are written to a temporary directory, so every test run
+    geocodes from the geonames data instead of the results of an earlier run.
+    """
+    tmp_path = tmp_path_factory.mktemp("geocode")
+    return Geocoder(cache_path=str(tmp_path / "geocode_cache"), parquet_path=str(tmp_path / "cities1000.parquet"))
@@ -6,12 +6,27 @@ extracting, and loading the data into a pandas DataFrame.
 The geocode method allows users to find the coordinates of a specified city, with optional country filtering.
 """
 
+import csv
+import dbm
+import io
 import os
+import shelve
+import threading
 import zipfile
 
 import requests
+import numpy as np
 import pandas as pd
 
+# shelve does not support concurrent writers, Streamlit sessions run in threads
+_cache_lock = threading.Lock()
+# errors of opening or reading the persistent cache, e.g. on a read-only file system or a corrupt dbm file
+_cache_errors = (OSError, *dbm.error)
+# increase when the matching of _geocode changes, so results persisted by an earlier version are dropped
+CACHE_VERSION = 1
+# errors of reading or writing the parquet snapshot, e.g. an unwritable directory, a corrupt file or a pyarrow without zstd
+_snapshot_errors = (OSError, ImportError, NotImplementedError, ValueError)
+
 class Geocoder:
     """
     The Geocoder class is designed to handle the process of downloading, extracting, and parsing geospatial data
@@ -21,32 +36,39 @@ class Geocoder:
 
     Attributes:
         url (str): The URL to download the GeoNames cities1000 dataset ZIP file.
-        download_path (str): The local file path where the downloaded ZIP file is saved.
         extract_dir (str): The directory where the ZIP file's contents are extracted.
         file_path (str): The path to the extracted data file (expected to be in the 'cities1000/cities1000.txt' location).
+        cache_path (str): The path of the shelve file persisting geocoding results across process restarts.
+                          Cities that are not found are not persisted, and the results are dropped when the data file changes.
+        parquet_path (str): The path of the parquet snapshot of the parsed data file, written on first load.
         data (pandas.DataFrame): The DataFrame containing the geospatial data loaded from the extracted file.
+                                 It is loaded lazily on the first lookup that misses the cache.
 
     Methods:
         __init__:
             Initializes the Geocoder by checking for the existence of the required data file. If the file does not exist,
-            it triggers the download and extraction process and subsequently loads the data into a DataFrame.
-        
-        download_zip():
-            Downloads the ZIP file from the specified URL and saves it to the local download_path. If the HTTP request fails,
-            an HTTPError is raised.
+            it triggers the download and extraction process.
         
-        unzip_file():
-            Unzips the downloaded ZIP file into the specified extract_dir. This method assumes that the ZIP file contains
-            exactly one file and returns the full path to the extracted file. It automatically creates the extraction directory 
-            if it does not already exist.
+        download_and_unzip():
+            Downloads the ZIP file from the specified URL and unzips it into the specified extract_dir without saving
+            the ZIP file to disk. This method assumes that the ZIP file contains exactly one file and returns the full path
+            to the extracted file. It automatically creates the extraction directory if it does not already exist.
+            If the HTTP request fails, an HTTPError is raised.
         
         load_dataframe(filepath, delimiter="\t"):
             Reads the tab-delimited data file given by filepath into a pandas DataFrame using predefined column names.
+
+        load_parquet_or_dataframe():
+            Reads the parquet snapshot at parquet_path, or parses file_path with load_dataframe and writes the snapshot.
         
         geocode(city: str, country=None) -> tuple[float, float] | tuple[None, None]:
             Locates and returns the latitude and longitude of the specified city by filtering the DataFrame (with an optional 
             country filter). It tries to match the city against multiple columns (name, asciiname, alternatenames) and returns
             the coordinates of the most likely match, preferably by population ranking if multiple matches are found.
+            Results are memoized in memory and persisted in the shelve file at cache_path.
+
+        geocode_many(cities, country=None) -> list[tuple[float, float] | tuple[None, None]]:
+            Geocodes several cities at once, reading and writing the persistent cache only once for all of them.
 
     Example:
         geocoder = Geocoder()
@@ -55,58 +77,71 @@ class Geocoder:
             print(f"Coordinates of Berlin: {latitude}, {longitude}")
             print("City not found.")
     """
-    def __init__(self, url="https://download.geonames.org/export/dump/cities1000.zip", download_path="cities1000.zip", extract_dir="cities1000"):
+    def __init__(self, url="https://download.geonames.org/export/dump/cities1000.zip", extract_dir="cities1000",
+                 cache_path="cities1000/geocode_cache", parquet_path="cities1000/cities1000.parquet"):
         self.url = url
-        self.download_path = download_path
         self.extract_dir = extract_dir
         self.file_path = 'cities1000/cities1000.txt'
+        self.cache_path = cache_path
+        self.parquet_path = parquet_path
         # check if file cities1000/cities1000.txt exists
         if os.path.exists(self.file_path):
             print(f"File {self.file_path} already exists.")
         else:
             print(f"File {self.file_path} does not exist. Downloading...")
-            self.download_zip()
-            self.file_path = self.unzip_file()
-            os.remove(self.download_path)
-        self.data = self.load_dataframe(self.file_path)
-
+            self.file_path = self.download_and_unzip()
+        self._data = None
+        self._country_lc = None
+        self._name_index = self._asciiname_index = self._country_name_index = self._country_asciiname_index = None
+        self._alternatenames_index = None
+        # found cities by "city|country", so repeated lookups don't open the persistent cache
+        self._found = {}
 
-    def download_zip(self):
+    @property
+    def data(self):
         """
-        Downloads a file from the URL specified in the instance and saves it as a ZIP file to the download path.
-
-        This method makes an HTTP GET request to the URL stored in the instance attribute 'url'. It raises an HTTPError
-        if the request fails. Upon a successful response, it writes the binary content of the response to a file located at
-        the path specified by the instance attribute 'download_path' and returns this path.
-
-        Returns:
-            str: The file path where the ZIP file has been saved.
-
-        Raises:
-            HTTPError: If the HTTP request returned an unsuccessful status code.
+        The geospatial data as a pandas DataFrame, loaded from file_path on first access.
         """
-        response = requests.get(self.url, timeout=30)
-        response.raise_for_status()
-        with open(self.download_path, "wb") as f:
-            f.write(response.content)
-        return self.download_path
+        if self._data is None:
+            data = self.load_parquet_or_dataframe()
+            # lower case columns for matching, computed once instead of on every lookup
+            name_lc = data['name'].str.lower().to_numpy()
+            asciiname_lc = data['asciiname'].str.lower().to_numpy()
+            self._country_lc = data['country_code'].str.lower().to_numpy()
+            # hash indexes from the lower case name to the row of the most populous match,
+            # rows are inserted from least to most populous so the most populous one is kept
+            rows = np.argsort(-data['population'].to_numpy(), kind='stable')[::-1]
+            self._name_index = dict(zip(name_lc[rows], rows))
+            self._asciiname_index = dict(zip(asciiname_lc[rows], rows))
+            self._country_name_index = dict(zip(zip(self._country_lc[rows], name_lc[rows]), rows))
+            self._country_asciiname_index = dict(zip(zip(self._country_lc[rows], asciiname_lc[rows]), rows))
+            self._data = data
+        return self._data
 
-    def unzip_file(self):
+    def download_and_unzip(self):
         """
-        Extracts the first file from the zip archive specified by self.download_path and returns its full path.
+        Downloads the ZIP file from the URL specified in the instance and extracts it into extract_dir,
+        returning the full path of the first extracted file.
 
-        This method performs the following actions:
-            1. Checks if the directory given by self.extract_dir exists and creates it if not.
-            2. Opens the zip file at self.download_path and extracts its contents into self.extract_dir.
-            3. Retrieves the list of files in the zip archive and returns the full path to the first file.
-            4. If the zip file is empty, it returns None.
+        The response is streamed into memory and extracted from there, so the ZIP file is never written to disk.
+        The directory given by self.extract_dir is created if it does not exist.
 
         Assumes:
             - The zip archive contains exactly one file.
+
+        Returns:
+            str: The path of the first file in the zip archive or None if the archive is empty.
+
+        Raises:
+            HTTPError: If the HTTP request returned an unsuccessful status code.
         """
-        if not os.path.exists(self.extract_dir):
-            os.makedirs(self.extract_dir)
-        with zipfile.ZipFile(self.download_path, "r") as zip_ref:
+        buffer = io.BytesIO()
+        with requests.get(self.url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                buffer.write(chunk)
+        os.makedirs(self.extract_dir, exist_ok=True)
+        with zipfile.ZipFile(buffer) as zip_ref:
             zip_ref.extractall(self.extract_dir)
             # Assuming the zip contains one file
             files = zip_ref.namelist()
@@ -115,6 +150,7 @@ class Geocoder:
     def load_dataframe(self, filepath, delimiter="\t"):
         """
         Loads a tabular dataset from a specified file into a pandas DataFrame using predefined column names.
+        Only the columns needed for geocoding are parsed, with compact dtypes to keep the memory footprint small.
 
         Parameters:
             filepath (str): The path to the input file containing the data.
@@ -123,25 +159,13 @@ class Geocoder:
 
         Returns:
             pandas.DataFrame: A DataFrame with the following columns:
-                - "geonameid"
                 - "name"
                 - "asciiname"
                 - "alternatenames"
-                - "latitude"
-                - "longitude"
-                - "feature_class"
-                - "feature_code"
+                - "latitude" (float32)
+                - "longitude" (float32)
                 - "country_code"
-                - "cc2"
-                - "admin1_code"
-                - "admin2_code"
-                - "admin3_code"
-                - "admin4_code"
-                - "population"
-                - "elevation"
-                - "dem"
-                - "timezone"
-                - "modification_date"
+                - "population" (int32)
         """
         # Column names
         columns = [
@@ -150,11 +174,39 @@ class Geocoder:
                 "admin2_code", "admin3_code", "admin4_code", "population", "elevation",
                 "dem", "timezone", "modification_date"
         ]
-        return pd.read_csv(filepath, delimiter=delimiter, low_memory=False, names=columns, encoding="utf-8")
+        usecols = ["name", "asciiname", "alternatenames", "latitude", "longitude", "country_code", "population"]
+        dtype = {"latitude": "float32", "longitude": "float32", "population": "int32"}
+        # geonames does not quote fields, a stray quote character must not swallow the following lines
+        return pd.read_csv(filepath, delimiter=delimiter, names=columns, usecols=usecols, dtype=dtype,
+                           quoting=csv.QUOTE_NONE, encoding="utf-8")
+
+    def load_parquet_or_dataframe(self):
+        """
+        Loads the geospatial data from the parquet snapshot at parquet_path if it is up to date.
+        Otherwise the data is parsed from file_path by load_dataframe and the snapshot is written,
+        so later process starts skip parsing the text file.
+        The snapshot is only an optimization, if it can not be read or written the text file is used.
+
+        Returns:
+            pandas.DataFrame: The DataFrame as returned by load_dataframe.
+        """
+        if os.path.exists(self.parquet_path) and os.path.getmtime(self.parquet_path) >= os.path.getmtime(self.file_path):
+            try:
+                return pd.read_parquet(self.parquet_path)
+            except _snapshot_errors as e:
+                print(f"Could not read {self.parquet_path}: {e}")
+        data = self.load_dataframe(self.file_path)
+        try:
+            data.to_parquet(self.parquet_path, compression="zstd")
+        except _snapshot_errors as e:
+            print(f"Could not write {self.parquet_path}: {e}")
+        return data
 
     def geocode(self, city: str, country=None) -> tuple[float, float] | tuple[None, None]:
         """"
         "Geocode a city using the geonames database.
+        Found cities are remembered by the instance and looked up in the persistent cache at cache_path,
+        so the geonames data only needs to be loaded for cities that have not been geocoded before.
         Parameters:
             city (str): The name of the city.
             state (str, optional): The state or province.
@@ -162,38 +214,113 @@ class Geocoder:
         Returns:
             tuple: A tuple containing the latitude and longitude of the city.
         """
-        data = self.data.copy()
+        return self.geocode_many([city], country)[0]
+
+    def geocode_many(self, cities, country=None) -> list[tuple[float, float] | tuple[None, None]]:
+        """
+        Geocode several cities at once, see geocode.
+        The persistent cache is opened once for all cities instead of once per city.
+        Parameters:
+            cities (iterable of str): The names of the cities.
+            country (str, optional): The country.
+        Returns:
+            list: A list of (latitude, longitude) tuples in the order of cities.
+        """
+        cities = list(cities)
+        keys = [f"{city}|{country or ''}" for city in cities]
+        unknown = {key: city for city, key in zip(cities, keys) if key not in self._found}
+        if unknown:
+            self._found.update(self._lookup(unknown, country))
+        return [self._found.get(key, (None, None)) for key in keys]
+
+    def _lookup(self, cities: dict, country=None) -> dict:
+        """
+        Looks up the cities given as {key: city} in the persistent cache and geocodes the ones that are not in it.
+        Returns the found cities as {key: (latitude, longitude)}.
+        """
+        try:
+            with _cache_lock, self._open_cache() as cache:
+                cached = {key: cache[key] for key in cities if key in cache}
+        except _cache_errors:
+            # the persistent cache is only an optimization, geocode without it
+            cached = None
+        missing = {key: self._geocode(city, country) for key, city in cities.items() if cached is None or key not in cached}
+        # cities that were not found are neither persisted nor remembered, they may be found in updated geonames data
+        found = {key: result for key, result in missing.items() if result != (None, None)}
+        if cached is None:
+            return found
+        if found:
+            try:
+                with _cache_lock, self._open_cache() as cache:
+                    cache.update(found)
+            except _cache_errors:
+                pass
+        return {**cached, **found}
+
+    def _open_cache(self):
+        """
+        Opens the persistent cache at cache_path.
+        Its contents are dropped if they were computed by another CACHE_VERSION or from another version of the file at file_path.
+        """
+        cache = shelve.open(self.cache_path)
+        version = (CACHE_VERSION, os.path.getmtime(self.file_path))
+        if cache.get("__version__") != version:
+            cache.clear()
+            cache["__version__"] = version
+        return cache
+
+    def _geocode(self, city: str, country=None) -> tuple[float, float] | tuple[None, None]:
+        """
+        Geocode a city by searching the geonames data, see geocode.
+        """
+        data = self.data
+        city_lc = city.lower()
 
         # these require a different table to resolve admin code and thus are not active
         # filter the dataframe based on city, state, and country
         #if state:
         #    data = data[data['admin1_code'].str.lower() == state.lower()]
 
+        # match the city name with the 'name' column and if there are no results with the 'asciiname' column
         if country:
-            data = data[data['country_code'].str.lower() == country.lower()]
-
-        result = data[data['name'].str.lower() == city.lower()]
-
-        # if there are no results, try to match the city name with the 'asciiname' column
-        if result.empty:
-            result = data[data['asciiname'].str.lower() == city.lower()]
+            key = (country.lower(), city_lc)
+            row = self._country_name_index.get(key)
+            if row is None:
+                row = self._country_asciiname_index.get(key)
+        else:
+            row = self._name_index.get(city_lc)
+            if row is None:
+                row = self._asciiname_index.get(city_lc)
+        if row is not None:
+            return float(data['latitude'].iat[row]), float(data['longitude'].iat[row])
 
         # if there are no results, try to match the city name with the 'alternatenames' column
-        if result.empty:
-            result = data[data['alternatenames'].str.contains(city.lower(), case=False, na=False, regex=False)]
-
-        # if there are multiple results, return the most likely one
-        if len(result) > 1:
-            # Sort by population (descending) and take the first one
-            result = result.sort_values(by='population', ascending=False).head(1)
-
-        if not result.empty:
-            lat = result.iloc[0]['latitude']
-            lon = result.iloc[0]['longitude']
-            return float(lat), float(lon)
+        rows = np.asarray(self.alternatenames_index.get(city_lc, []), dtype=np.intp)
+        if country:
+            rows = rows[self._country_lc[rows] == country.lower()]
+
+        if len(rows):
+            # if there are multiple results, return the most populous one
+            row = rows[np.argmax(data['population'].to_numpy()[rows])]
+            return float(data['latitude'].iat[row]), float(data['longitude'].iat[row])
         else:
             return None, None
 
+    @property
+    def alternatenames_index(self):
+        """
+        Inverted index from the lower case alternate names to the rows they belong to.
+        It is built on first access as it is only needed for names that do not match exactly.
+        """
+        if self._alternatenames_index is None:
+            index = {}
+            for row, alternatenames in enumerate(self.data['alternatenames'].fillna('').to_numpy()):
+                for name in alternatenames.lower().split(','):
+                    if name:
+                        index.setdefault(name.strip(), []).append(row)
+            self._alternatenames_index = index
+        return self._alternatenames_index
+
 if __name__ == "__main__":
     geocoder = Geocoder()
 
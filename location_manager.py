@@ -1,11 +1,23 @@
 """A class to manage location derived from ip address or from self localization vis streamlit_geolocation."""
+import ipaddress
+import logging
+import os
+from types import MappingProxyType
+
+import requests
 import streamlit as st
 from streamlit_geolocation import streamlit_geolocation
-import reverse_geocoder as rg # reverse geocode from coordinates
-import geocoder # geocode from ip adress
+
+logger = logging.getLogger(__name__)
+
+# short names of all German provinces
+PROVINCES_SHORT = frozenset({'BB', 'BE', 'BW', 'BY', 'HB', 'HE', 'HH', 'MV', 'NI', 'NW', 'RP', 'SH', 'SL', 'SN', 'ST', 'TH'})
+
+# (min latitude, max latitude, min longitude, max longitude) enclosing Germany
+GERMANY_BBOX = (47.2, 55.1, 5.8, 15.1)
 
 # map admin2 to short name e.g. 'bavaria' to 'BY'
-province2short = {
+province2short = MappingProxyType({
     'Baden-Wurttemberg': 'BW',
     'Bavaria': 'BY',
     'Berlin': 'BE',
@@ -22,14 +34,10 @@ province2short = {
     'Sachsen-Anhalt': 'ST',
     'Schleswig-Holstein': 'SH',
     'Thuringen': 'TH'
-}
-
-# check that all short provinces are in province2short
-for province in ['BB', 'BE', 'BW', 'BY', 'HB', 'HE', 'HH', 'MV', 'NI', 'NW', 'RP', 'SH', 'SL', 'SN', 'ST', 'TH']:
-    assert province in province2short.values()
+})
 
 # map admin2 to ['Mitte (West)', 'Norden (West)', 'Osten', 'Sueden']
-province2region = {
+province2region = MappingProxyType({
     'BW': 'Sueden',
     'BY': 'Sueden',
     'BE': 'Mitte (West)',
@@ -46,11 +54,10 @@ province2region = {
     'ST': 'Osten',
     'SH': 'Norden (West)',
     'TH': 'Osten'
-}
+})
 
-# check that all short provinces are in province2region
-for province in ['BB', 'BE', 'BW', 'BY', 'HB', 'HE', 'HH', 'MV', 'NI', 'NW', 'RP', 'SH', 'SL', 'SN', 'ST', 'TH']:
-    assert province in province2region.keys(), f'{province} not in province2region'
+# map admin2 to short name and region in one lookup e.g. 'Bavaria' to ('BY', 'Sueden')
+province2short_region = MappingProxyType({province: (short, province2region[short]) for province, short in province2short.items()})
 
 
 def get_forwarded_ip() -> str | None:
@@ -58,42 +65,161 @@ def get_forwarded_ip() -> str | None:
     Get the IP address from the X-Forwarded-For header.
     This is useful when the app is behind a reverse proxy or load balancer.
     """
-    headers = st.context.headers
     # Example: "X-Forwarded-For': '13.51.91.225, 162.158.90.188'"
-    if 'X-Forwarded-For' in headers:
-        x_forwarded_for = headers['X-Forwarded-For']
-        first_ip = x_forwarded_for.split(', ')[0]
+    x_forwarded_for = st.context.headers.get('X-Forwarded-For')
+    if not x_forwarded_for:
+        return None
+    # the first address is the client, only split off that one
+    first_ip, _, _ = x_forwarded_for.partition(',')
+    return first_ip.strip() or None
+
+# one HTTP session for all ip lookups, keeps the connection to ipinfo.io alive between lookups
+_ipinfo_session = requests.Session()
+# Streamlit sessions run in threads, allow some concurrent lookups to keep their connections too
+_ipinfo_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=8))
+
+# optional local MaxMind GeoLite2 City database, ip addresses are looked up in it instead of with ipinfo.io if it exists
+GEOLITE2_CITY_PATH = os.environ.get('GEOLITE2_CITY_PATH', 'GeoLite2-City.mmdb')
+
+@st.cache_resource
+def get_geolite2_reader():
+    """
+    Returns a reader of the GeoLite2 City database at GEOLITE2_CITY_PATH shared by all sessions,
+    or None if there is no such database or maxminddb is not installed.
+    """
+    if not os.path.exists(GEOLITE2_CITY_PATH):
+        return None
+    # imported here as maxminddb is only needed if a database is provided
+    try:
+        import maxminddb  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        logger.warning('%s exists but maxminddb is not installed, looking up ip addresses with ipinfo.io', GEOLITE2_CITY_PATH)
+        return None
+    return maxminddb.open_database(GEOLITE2_CITY_PATH, maxminddb.MODE_AUTO)
+
+def lookup_ip_geolite2(reader, ip_address: str) -> dict | None:
+    """
+    Look up the location of an ip address in the GeoLite2 City database of the reader.
+    Returns None if the address is invalid or not in the database.
+    """
+    try:
+        record = reader.get(ip_address)
+    except ValueError:
+        return None
+    if record is None or 'location' not in record:
+        return None
+    location = {
+        'city': record.get('city', {}).get('names', {}).get('en'),
+        'country': record.get('country', {}).get('iso_code'),
+        'latitude': record['location'].get('latitude'),
+        'longitude': record['location'].get('longitude'),
+    }
+    if record.get('subdivisions'):
+        subdivision = record['subdivisions'][0]
+        location['province'] = subdivision.get('names', {}).get('en')
+        # the subdivision codes of the German provinces are their short names, e.g. BY of DE-BY
+        if subdivision.get('iso_code') in PROVINCES_SHORT:
+            location['province_short'] = subdivision['iso_code']
+    return location
 
-        return first_ip
-    else:
+def lookup_ip_ipinfo(ip_address: str) -> dict | None:
+    """
+    Look up the location of an ip address with ipinfo.io.
+    Returns None if the address is invalid or the lookup failed.
+    """
+    try:
+        # the address comes from a request header, make sure it is one before putting it into the url
+        ipaddress.ip_address(ip_address)
+        # the page waits for the location, rather fall back to browser localization than stall on a slow response
+        response = _ipinfo_session.get(f'https://ipinfo.io/{ip_address}/json', timeout=2)
+        response.raise_for_status()
+        ipinfo = response.json()
+        # e.g. private addresses have no location
+        if 'loc' not in ipinfo:
+            return None
+        # Example: "loc": "48.1374,11.5755"
+        latitude, _, longitude = ipinfo['loc'].partition(',')
+        return {
+            'city': ipinfo.get('city'),
+            'country': ipinfo.get('country'),
+            'province': ipinfo.get('region'),
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+        }
+    except (ValueError, TypeError, AttributeError, requests.RequestException):
         return None
 
+@st.cache_data(ttl=24 * 3600, max_entries=4096, show_spinner=False)
+def lookup_ip(ip_address: str) -> dict | None:
+    """
+    Look up the location of an ip address in the local GeoLite2 City database if there is one, otherwise with ipinfo.io.
+    Cached per ip address for a day, so new sessions from the same address do not query ipinfo.io again.
+    The number of cached addresses is bounded to keep the memory of a long running server in check.
+    Returns None if the lookup failed.
+    """
+    reader = get_geolite2_reader()
+    if reader is not None:
+        return lookup_ip_geolite2(reader, ip_address)
+    return lookup_ip_ipinfo(ip_address)
+
+@st.cache_resource(show_spinner=False)
+def get_reverse_geocoder():
+    """
+    Returns the reverse geocoder shared by all sessions.
+    Creating it parses the bundled geonames file and builds a k-d tree, which is done once per process,
+    and only if a province has to be reverse geocoded at all.
+    """
+    # imported here as it is only needed if the province is not known from the ip address
+    import reverse_geocoder as rg  # pylint: disable=import-outside-toplevel
+    return rg.RGeocoder(mode=1, verbose=False)
+
+def reverse_geocode(points: list[tuple[float, float]]) -> list[dict]:
+    """
+    Reverse geocode several (latitude, longitude) points with a single query of the k-d tree,
+    returning the nearest geonames place of each point in order.
+    """
+    if not points:
+        return []
+    return get_reverse_geocoder().query(points)
+
+@st.cache_data(show_spinner=False)
+def reverse_geocode_province(latitude: float, longitude: float) -> str:
+    """
+    Get the province (admin1) of the coordinates by offline reverse geocoding.
+    Callers round the coordinates, so nearby locations share the cached result.
+    """
+    return reverse_geocode([(latitude, longitude)])[0]['admin1']
+
 class LocationManager:
     """A class to manage location derived from ip address or from self localization."""
 
-    def __init__(self):
+    __slots__ = ('ip_address', 'location')
+
+    def __init__(self, ip_address: str | None = None):
         """
-        Initialize the LocationManager with the path to the geonames file.
+        Initialize the LocationManager from the ip address of the user or from the browser localization.
 
         Args:
-            geonames_file (str): The path to the geonames file.
-            delimiter (str): The delimiter used in the geonames file. Default is tab.
+            ip_address (str): The ip address of the user. Default is the address from the X-Forwarded-For header.
         """
-        self.ip_address = get_forwarded_ip()
+        self.ip_address = ip_address or get_forwarded_ip()
+        # reuse the location resolved in an earlier rerun of this session
+        if 'location' in st.session_state and st.session_state.get('location_ip') == self.ip_address:
+            self.location = st.session_state['location']
+            return
+
         self.location = {}
         if self.ip_address:
-            geocoder_result = geocoder.ipinfo(self.ip_address)
-            if geocoder_result.error is False:
+            ip_location = lookup_ip(self.ip_address)
+            if ip_location is not None:
                 # geocode was successful
-                if geocoder_result.current_result.country == 'DE':
-                    self.location['city'] = geocoder_result.current_result.city
-                    self.location['country'] = geocoder_result.current_result.country
-                    self.location['province'] = geocoder_result.current_result.province
-                    self.location['latitude'] = geocoder_result.current_result.lat
-                    self.location['longitude'] = geocoder_result.current_result.lng
+                if ip_location['country'] == 'DE':
+                    self.location.update(ip_location)
                 else:
                     st.warning("You seem to be outside of Germany but the data is only available for Germany. Please select your location of interest manually.")
             else:
+                # do not keep the failed lookup cached, it is retried in the next session
+                lookup_ip.clear(self.ip_address)
                 st.warning(f"Could not determine your location from IP address {self.ip_address}. Please accept localization via browser or select your location of interest manually.")
                 self.get_location_from_browser()
         else:
@@ -102,7 +228,12 @@ class LocationManager:
 
         self.add_province()
         self.add_province_short()
-        print(self.location)
+        logger.debug('location=%s', self.location)
+
+        # only keep resolved locations, otherwise the browser localization has to be offered again
+        if self.location.get('latitude') is not None and self.location.get('longitude') is not None:
+            st.session_state['location'] = self.location
+            st.session_state['location_ip'] = self.ip_address
 
     def get_location_from_browser(self):
         """
@@ -116,20 +247,33 @@ class LocationManager:
         """
         Get the province from the location if necessary.
         """
-        if 'latitude' in self.location and self.location['latitude'] is not None and 'longitude' in self.location and self.location['longitude'] is not None and not 'province' in self.location:
-            # add province to location
-            # get the coordinates from the location
-            coordinates = (self.location['latitude'], self.location['longitude'])
-            # use reverse geocoding to get the province from the coordinates
-            geocode = rg.search(coordinates, mode=1)
-            # transform administrative area to bundesland, bavaria to BY
-            self.location['province'] = geocode[0]['admin1']
+        location = self.location
+        # the province is usually already known from the ip address
+        if 'province' in location:
+            return
+        latitude = location.get('latitude')
+        longitude = location.get('longitude')
+        if latitude is None or longitude is None:
+            return
+        # coordinates outside of the bounding box of Germany can not be in a German province
+        if not (GERMANY_BBOX[0] <= latitude <= GERMANY_BBOX[1] and GERMANY_BBOX[2] <= longitude <= GERMANY_BBOX[3]):
+            return
+        # add province to location
+        # use reverse geocoding to get the province from the coordinates,
+        # rounded to about 1 km which is plenty for the province
+        location['province'] = reverse_geocode_province(round(latitude, 2), round(longitude, 2))
 
     def add_province_short(self):
         """
         Add the province short name to the location.
         """
         if 'province' in self.location :
-            # add province short name to location and region
-            self.location['province_short'] = province2short[self.location['province']]
-            self.location['region'] = province2region[self.location['province_short']]
+            # add province short name to location and region, unless it is already known from the ip address
+            if 'province_short' not in self.location:
+                short_region = province2short_region.get(self.location['province'])
+                # not a known German province, the location of interest has to be selected manually
+                if short_region is None:
+                    return
+                self.location['province_short'], self.location['region'] = short_region
+            else:
+                self.location['region'] = province2region[self.location['province_short']]
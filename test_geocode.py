@@ -1,22 +1,74 @@
-from geocode import Geocoder   
+import shelve
 
-def test_geocode():
+import pytest
+
+from geocode import CACHE_VERSION, Geocoder
+
+# Test cases
+TEST_CASES = (
+    ("Los Angeles", "CA", None),
+    ("Munich", None, None),
+    ("München", None, None),
+    ("Altötting", "BY", "DE"),
+)
+
+@pytest.mark.parametrize("city, state, country", TEST_CASES)
+def test_geocode(geocoder, city, state, country):
     """
     Test the geocode function of the Geocoder class.
     """
-    # Create an instance of the Geocoder class
-    geocoder = Geocoder()
+    result = geocoder.geocode(city, country)
+    print(f"Coordinates of {city}, {state}, {country}: {result}")
+
+    assert result != (None,None), f"Geocode failed for {city}, {state}, {country}"
+
+def test_geocode_alternate_name(geocoder):
+    """
+    Test that a city is found by an exact alternate name, but not by a part of one.
+    """
+    # Munich is listed with the alternate name Muenchen
+    assert geocoder.geocode("Muenchen", "DE") == pytest.approx((48.13743, 11.57549), abs=1e-4)
+    assert geocoder.geocode("uenche", "DE") == (None, None)
+
+def test_geocode_alternate_name_country(geocoder):
+    """
+    Test that the alternate name lookup only returns cities of the given country.
+    """
+    assert geocoder.geocode("Muenchen", "AT") == (None, None)
 
-    # Test cases
-    test_cases = [
-        ("Los Angeles", "CA", None),
-        ("Munich", None, None),
-        ("München", None, None),
-        ("Altötting", "BY", "DE"),
-    ]
+def test_geocode_most_populous(geocoder):
+    """
+    Test that the most populous of several matching cities is returned.
+    """
+    # Frankfurt is an alternate name of Frankfurt am Main, Frankfurt (Oder) and several Frankforts in the US
+    assert geocoder.geocode("Frankfurt", "DE") == pytest.approx((50.11552, 8.68417), abs=1e-4)
+    assert geocoder.geocode("Frankfurt") == pytest.approx((50.11552, 8.68417), abs=1e-4)
+    # two cities named Dondo in Angola have the same population, the first one in the data wins
+    assert geocoder.geocode("Dondo", "AO") == pytest.approx((-9.68456, 14.42788), abs=1e-4)
 
-    for city, state, country in test_cases:
-        result = geocoder.geocode(city, country)
-        print(f"Coordinates of {city}, {state}, {country}: {result}")
+def test_geocode_cache(tmp_path):
+    """
+    Test that found cities are persisted and remembered, cities that were not found are not,
+    and that the persistent cache is dropped when the geonames data changes.
+    """
+    cache_path = str(tmp_path / "geocode_cache")
+    geocoder = Geocoder(cache_path=cache_path, parquet_path=str(tmp_path / "cities1000.parquet"))
+    assert geocoder.geocode_many(["München", "Nirgendwodorf"], "DE")[1] == (None, None)
+    assert "München|DE" in geocoder._found
+    assert "Nirgendwodorf|DE" not in geocoder._found
+    with shelve.open(cache_path) as cache:
+        assert "München|DE" in cache
+        assert "Nirgendwodorf|DE" not in cache
+        # as if the results were computed from an older version of the data file
+        cache["__version__"] = (CACHE_VERSION, 0)
+    geocoder.geocode_many(["Altötting"], "DE")
+    with shelve.open(cache_path) as cache:
+        assert "München|DE" not in cache
+        assert "Altötting|DE" in cache
 
-        assert result != (None,None), f"Geocode failed for {city}, {state}, {country}"
+def test_geocode_without_cache(tmp_path):
+    """
+    Test that cities are still geocoded if neither the persistent cache nor the parquet snapshot can be written.
+    """
+    geocoder = Geocoder(cache_path=str(tmp_path / "missing" / "geocode_cache"), parquet_path=str(tmp_path / "missing" / "cities1000.parquet"))
+    assert geocoder.geocode("München", "DE") == pytest.approx((48.13743, 11.57549), abs=1e-4)
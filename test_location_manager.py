@@ -0,0 +1,132 @@
+import sys
+
+import requests
+
+import location_manager
+from location_manager import PROVINCES_SHORT, LocationManager, province2short, province2region, lookup_ip_ipinfo
+
+
+class FakeResponse:
+    """
+    Stands in for the requests.Response of ipinfo.io.
+    """
+    def __init__(self, json, status_code=200):
+        self._json = json
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+    def json(self):
+        return self._json
+
+
+def fake_ipinfo(monkeypatch, response):
+    """
+    Let the ipinfo.io session return the given response and record the requested urls.
+    """
+    urls = []
+    def get(url, **kwargs):
+        urls.append(url)
+        return response
+    monkeypatch.setattr(location_manager._ipinfo_session, 'get', get)
+    return urls
+
+def test_province_tables():
+    """
+    Test that all short province names are covered by the province tables of the location_manager module.
+    """
+    # check that province2short maps to exactly the short provinces
+    assert frozenset(province2short.values()) == PROVINCES_SHORT, f'{PROVINCES_SHORT ^ frozenset(province2short.values())} differ in province2short'
+
+    # check that province2region maps exactly the short provinces
+    assert province2region.keys() == PROVINCES_SHORT, f'{PROVINCES_SHORT ^ province2region.keys()} differ in province2region'
+
+def test_lookup_ip_ipinfo(monkeypatch):
+    """
+    Test that a valid ipinfo.io response is turned into a location.
+    """
+    urls = fake_ipinfo(monkeypatch, FakeResponse({'ip': '1.2.3.4', 'city': 'Munich', 'region': 'Bavaria', 'country': 'DE', 'loc': '48.1374,11.5755'}))
+    assert lookup_ip_ipinfo('1.2.3.4') == {'city': 'Munich', 'country': 'DE', 'province': 'Bavaria', 'latitude': 48.1374, 'longitude': 11.5755}
+    assert urls == ['https://ipinfo.io/1.2.3.4/json']
+
+def test_lookup_ip_ipinfo_without_location(monkeypatch):
+    """
+    Test that responses without a usable location, e.g. for private addresses, fail the lookup.
+    """
+    fake_ipinfo(monkeypatch, FakeResponse({'ip': '10.0.0.1', 'bogon': True}))
+    assert lookup_ip_ipinfo('10.0.0.1') is None
+    fake_ipinfo(monkeypatch, FakeResponse({'ip': '1.2.3.4', 'loc': ''}))
+    assert lookup_ip_ipinfo('1.2.3.4') is None
+
+def test_lookup_ip_ipinfo_invalid_address(monkeypatch):
+    """
+    Test that an invalid address fails the lookup without querying ipinfo.io.
+    """
+    urls = fake_ipinfo(monkeypatch, FakeResponse({}))
+    assert lookup_ip_ipinfo('../1.2.3.4') is None
+    assert not urls
+
+def test_lookup_ip_ipinfo_http_error(monkeypatch):
+    """
+    Test that an HTTP error, e.g. from rate limiting, fails the lookup.
+    """
+    fake_ipinfo(monkeypatch, FakeResponse({'error': {'title': 'Rate limit exceeded'}}, status_code=429))
+    assert lookup_ip_ipinfo('1.2.3.4') is None
+
+def location_manager_with(location):
+    """
+    A LocationManager with the given location, bypassing the localization of __init__.
+    """
+    manager = LocationManager.__new__(LocationManager)
+    manager.location = location
+    return manager
+
+def test_add_province_outside_germany(monkeypatch):
+    """
+    Test that coordinates outside of the bounding box of Germany are not reverse geocoded.
+    """
+    def reverse_geocode_province(latitude, longitude):
+        raise AssertionError(f"reverse geocoded {latitude}, {longitude}")
+    monkeypatch.setattr(location_manager, 'reverse_geocode_province', reverse_geocode_province)
+    # Paris
+    manager = location_manager_with({'latitude': 48.8566, 'longitude': 2.3522})
+    manager.add_province()
+    manager.add_province_short()
+    assert manager.location == {'latitude': 48.8566, 'longitude': 2.3522}
+
+def test_add_province_inside_germany(monkeypatch):
+    """
+    Test that coordinates inside of the bounding box of Germany are reverse geocoded to the province and region.
+    """
+    monkeypatch.setattr(location_manager, 'reverse_geocode_province', lambda latitude, longitude: 'Bavaria')
+    manager = location_manager_with({'latitude': 48.1374, 'longitude': 11.5755})
+    manager.add_province()
+    manager.add_province_short()
+    assert manager.location['province_short'] == 'BY'
+    assert manager.location['region'] == 'Sueden'
+
+def test_add_province_short_unknown_province():
+    """
+    Test that an unknown province name leaves the short name and region unset instead of raising.
+    """
+    manager = location_manager_with({'latitude': 51.0504, 'longitude': 13.7373, 'province': 'Saxony'})
+    manager.add_province_short()
+    assert 'province_short' not in manager.location
+    assert 'region' not in manager.location
+
+def test_get_geolite2_reader_without_maxminddb(monkeypatch, tmp_path):
+    """
+    Test that a GeoLite2 database without the maxminddb package falls back to ipinfo.io instead of failing.
+    """
+    database = tmp_path / "GeoLite2-City.mmdb"
+    database.write_bytes(b"")
+    monkeypatch.setattr(location_manager, 'GEOLITE2_CITY_PATH', str(database))
+    # None in sys.modules makes the import fail
+    monkeypatch.setitem(sys.modules, 'maxminddb', None)
+    location_manager.get_geolite2_reader.clear()
+    try:
+        assert location_manager.get_geolite2_reader() is None
+    finally:
+        location_manager.get_geolite2_reader.clear()